@@ -1,72 +1,428 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, String, Float, Text, Boolean
+import hashlib
+import os
+import secrets
+import time
+import orjson
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, JSON, Index, PrimaryKeyConstraint, event, insert, update, text, select, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert, dialect as SQLiteDialect
+from sqlalchemy.schema import CreateIndex, CreateTable
 
-DATABASE_URL = "sqlite+aiosqlite:///./rmgt.db"
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
-SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# Only the database file is configurable: the schema, upserts and PRAGMAs here are SQLite-specific
+_database_url = make_url(os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./rmgt.db"))
+if _database_url.drivername != "sqlite+aiosqlite" or not _database_url.database:
+    raise ValueError(f"DATABASE_URL must point at a sqlite+aiosqlite file, got {_database_url!r}")
+DATABASE_PATH = _database_url.database
+DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+# Same file opened read-only; under WAL these readers never wait on the writer
+READONLY_DATABASE_URL = f"sqlite+aiosqlite:///file:{DATABASE_PATH}?mode=ro&uri=true"
+# Statement logging is opt-in; echoing every query is far more expensive than the query itself
+SQL_ECHO = os.environ.get("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+
+def json_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+json_loads = orjson.loads
+
+# Keep connections pooled so each one's page cache and PRAGMA setup survive between requests
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    future=True,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=5,
+    max_overflow=10,
+    pool_recycle=3600,
+    pool_pre_ping=False,
+    json_serializer=json_dumps,
+    json_deserializer=json_loads
+)
+ro_engine = create_async_engine(
+    READONLY_DATABASE_URL,
+    echo=SQL_ECHO,
+    future=True,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=10,
+    pool_recycle=3600,
+    pool_pre_ping=False,
+    json_serializer=json_dumps,
+    json_deserializer=json_loads
+)
+
+def _apply_sqlite_pragmas(dbapi_conn, read_only):
+    # Runs once per new connection: WAL lets readers proceed during writes and
+    # NORMAL sync drops the per-commit fsync that FULL does in WAL mode
+    cursor = dbapi_conn.cursor()
+    if not read_only:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")  # per connection, and a no-op inside a transaction
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.close()
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    _apply_sqlite_pragmas(dbapi_conn, read_only=False)
+    # Stop the driver from managing transactions itself: left alone it only opens one before
+    # INSERT/UPDATE/DELETE, so DDL (the schema migration) would autocommit statement by statement
+    dbapi_conn.isolation_level = None
+
+@event.listens_for(engine.sync_engine, "begin")
+def _begin_immediate(conn):
+    # Every write-engine transaction, DDL included, is explicit and atomic. IMMEDIATE takes the
+    # write lock up front, so read-then-write handlers never act on a stale WAL snapshot
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+@event.listens_for(ro_engine.sync_engine, "connect")
+def _set_readonly_sqlite_pragmas(dbapi_conn, connection_record):
+    _apply_sqlite_pragmas(dbapi_conn, read_only=True)
+
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+ReadSession = async_sessionmaker(ro_engine, expire_on_commit=False)
 Base = declarative_base()
 
+# Timestamps are stored as integer Unix epoch milliseconds
+def now_ms():
+    return int(time.time() * 1000)
+
+def ms_to_seconds(ms):
+    return ms / 1000 if ms is not None else None
+
+def _new_row_id():
+    # WITHOUT ROWID tables get no automatic ids, so append-only rows draw a random 63-bit one
+    return secrets.randbits(63)
+
 class ForSaleItem(Base):
     __tablename__ = "for_sale_items"
-    id = Column(Integer, primary_key=True, index=True)
-    def_name = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    def_name = Column(String)
     quantity = Column(Integer)
     price = Column(Integer)
     player_name = Column(String)
-    seller_steam_id = Column(String, index=True)
-    quality = Column(String, default="")
+    seller_steam_id = Column(BigInteger)
+    quality = Column(String(16), default="")
     item_id = Column(String, nullable=True)
-    listed_at = Column(Float)
+    listed_at = Column(BigInteger)
+    __table_args__ = (
+        # Covers the per-seller listing columns so my-items can be answered from the index alone
+        Index(
+            "ix_forsale_seller_listing",
+            "seller_steam_id", "def_name", "quantity", "price", "player_name", "quality"
+        ),
+        Index("ix_forsale_def_seller_name", "def_name", "player_name"),  # buy lookups
+    )
 
 class SaleHistory(Base):
     __tablename__ = "sales_history"
-    id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(Float)
-    buyer_steam_id = Column(String, index=True)
+    id = Column(Integer, default=_new_row_id)
+    timestamp = Column(BigInteger)
+    buyer_steam_id = Column(BigInteger)
     buyer_name = Column(String)
-    purchased_items = Column(Text)  # JSON string
+    purchased_items = Column(JSON)
     total_cost = Column(Integer)
-    seller_steam_id = Column(String, index=True, nullable=True)
+    seller_steam_id = Column(BigInteger, nullable=True)
     seller_name = Column(String, nullable=True)
+    __table_args__ = (
+        Index("ix_sales_buyer_ts", "buyer_steam_id", "timestamp"),
+        Index("ix_sales_seller_ts", "seller_steam_id", "timestamp"),
+        PrimaryKeyConstraint("timestamp", "id"),
+        {"sqlite_with_rowid": False},
+    )
 
 class PendingSale(Base):
     __tablename__ = "pending_sales"
-    id = Column(Integer, primary_key=True, index=True)
-    seller_steam_id = Column(String, index=True)
+    id = Column(Integer, default=_new_row_id)
+    seller_steam_id = Column(BigInteger)
     buyer_name = Column(String)
     item = Column(String)
     quantity = Column(Integer)
     price = Column(Integer)
     total_silver = Column(Integer)
-    timestamp = Column(Float)
+    timestamp = Column(BigInteger)
+    # Clustered by seller, so listing and claiming a seller's sales reads one contiguous range
+    __table_args__ = (
+        PrimaryKeyConstraint("seller_steam_id", "timestamp", "id"),
+        {"sqlite_with_rowid": False},
+    )
 
 class ActiveUser(Base):
     __tablename__ = "active_users"
-    steam_id = Column(String, primary_key=True, index=True)
+    steam_id = Column(BigInteger, primary_key=True)
     player_name = Column(String)
-    last_seen = Column(Float)
+    last_seen = Column(BigInteger)
 
 class ActiveToken(Base):
     __tablename__ = "active_tokens"
-    token = Column(String, primary_key=True, index=True)
-    steam_id = Column(String, index=True)
+    token = Column(String, primary_key=True)
+    steam_id = Column(BigInteger)
     player_name = Column(String)
-    issued_at = Column(Float)
-    expires_at = Column(Float)
+    issued_at = Column(BigInteger)
+    expires_at = Column(BigInteger)
     revoked = Column(Integer, default=0)
+    # Per-user lookups only care about live tokens, so revoked rows stay out of this index
+    __table_args__ = (
+        Index("ix_active_tokens_live_user", "steam_id", sqlite_where=text("revoked = 0")),
+    )
 
 class UserSession(Base):
     __tablename__ = "user_sessions"
-    id = Column(Integer, primary_key=True, index=True)
-    steam_id = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    steam_id = Column(BigInteger)
     player_name = Column(String)
-    session_start = Column(Float)
-    session_end = Column(Float, nullable=True)  # NULL if session is still active
-    last_activity = Column(Float)
+    session_start = Column(BigInteger)
+    session_end = Column(BigInteger, nullable=True)  # NULL if session is still active
+    last_activity = Column(BigInteger)
     is_active = Column(Boolean, default=True)
     user_agent = Column(String, nullable=True)
+    # Closed sessions accumulate forever; only open ones are looked up by steam_id
+    __table_args__ = (
+        Index("ix_sessions_active", "steam_id", sqlite_where=text("is_active = 1")),
+        # Newest-first admin listing; the rowid (id) rides along as the keyset tie-breaker
+        Index("ix_sessions_start", "session_start"),
+    )
+
+# Hot statements are built once at import; SQLAlchemy's compiled cache then reuses their SQL
+_insert_active_user = sqlite_insert(ActiveUser).values(
+    steam_id=bindparam("sid"),
+    player_name=bindparam("name"),
+    last_seen=bindparam("ts")
+)
+# One statement instead of SELECT then INSERT/UPDATE
+UPSERT_ACTIVE_USER = _insert_active_user.on_conflict_do_update(
+    index_elements=["steam_id"],
+    set_={
+        "player_name": _insert_active_user.excluded.player_name,
+        "last_seen": _insert_active_user.excluded.last_seen
+    }
+)
+
+# Token renewal, run as an executemany over a batch of {"tok", "exp"} params
+RENEW_TOKEN = (
+    update(ActiveToken.__table__)
+    .where(ActiveToken.__table__.c.token == bindparam("tok"))
+    .values(expires_at=bindparam("exp"))
+)
+
+# Renewal only refreshes last_seen: a row deleted by logout or cleanup stays deleted, and the
+# name recorded at login is not overwritten by an older token's claim
+RENEW_ACTIVE_USER = (
+    update(ActiveUser.__table__)
+    .where(ActiveUser.__table__.c.steam_id == bindparam("sid"))
+    .values(last_seen=bindparam("ts"))
+)
+
+# Refreshes a user's open sessions; the partial ix_sessions_active index finds them
+TOUCH_USER_SESSIONS = (
+    update(UserSession.__table__)
+    .where(
+        UserSession.__table__.c.steam_id == bindparam("sid"),
+        UserSession.__table__.c.is_active == True
+    )
+    .values(last_activity=bindparam("ts"))
+)
+
+# The columns a listing response needs; all are in ix_forsale_seller_listing (id is the rowid)
+LISTING_COLUMNS = (
+    ForSaleItem.id,
+    ForSaleItem.def_name,
+    ForSaleItem.quantity,
+    ForSaleItem.price,
+    ForSaleItem.player_name,
+    ForSaleItem.quality,
+)
+
+async def stream_listings(session, **filters):
+    """Yield for-sale rows as plain dicts, fetched in chunks without building ORM instances."""
+    stmt = (
+        select(*LISTING_COLUMNS)
+        .filter_by(**filters)
+        .order_by(ForSaleItem.id)
+        .execution_options(yield_per=500)
+    )
+    result = await session.stream(stmt)
+    async for row in result.mappings():
+        yield dict(row)
+
+async def read_scalar(stmt):
+    """Run a single-value query on its own read-only session, so several can be gathered."""
+    async with ReadSession() as session:
+        return await session.scalar(stmt)
+
+async def touch_active_user(session, steam_id, name, ts):
+    """Create or refresh a user's active_users row in one round-trip."""
+    await session.execute(UPSERT_ACTIVE_USER, {"sid": steam_id, "name": name, "ts": ts})
+
+async def bulk_insert_for_sale(session, rows):
+    """Insert many listings with a single executemany; rows are plain dicts keyed by column name."""
+    if rows:
+        await session.execute(insert(ForSaleItem), rows)
+
+# Indexes superseded by the composite and partial indexes above
+LEGACY_INDEXES = (
+    "ix_for_sale_items_def_name",
+    "ix_for_sale_items_seller_steam_id",
+    "ix_sales_history_buyer_steam_id",
+    "ix_sales_history_seller_steam_id",
+    # Duplicated the primary key (rowid or sqlite_autoindex) index
+    "ix_active_tokens_token",
+    "ix_for_sale_items_id",
+    "ix_active_users_steam_id",
+    "ix_user_sessions_id",
+    # Superseded by the partial indexes on live tokens and open sessions
+    "ix_active_tokens_steam_id",
+    "ix_user_sessions_steam_id",
+    "ix_forsale_seller_def",  # prefix of ix_forsale_seller_listing
+)
+
+# Columns older databases hold in another representation: (legacy declared types, conversion SQL)
+_SECONDS_TO_MILLISECONDS = (("FLOAT",), "CAST({column} * 1000 AS INTEGER)")
+_TEXT_TO_STEAM_ID = (("VARCHAR", "VARCHAR(17)"), "CAST({column} AS INTEGER)")
+LEGACY_COLUMN_CONVERSIONS = {
+    "for_sale_items": {"listed_at": _SECONDS_TO_MILLISECONDS, "seller_steam_id": _TEXT_TO_STEAM_ID},
+    "sales_history": {
+        "timestamp": _SECONDS_TO_MILLISECONDS,
+        "buyer_steam_id": _TEXT_TO_STEAM_ID,
+        "seller_steam_id": _TEXT_TO_STEAM_ID
+    },
+    "pending_sales": {"timestamp": _SECONDS_TO_MILLISECONDS, "seller_steam_id": _TEXT_TO_STEAM_ID},
+    "active_users": {"last_seen": _SECONDS_TO_MILLISECONDS, "steam_id": _TEXT_TO_STEAM_ID},
+    "active_tokens": {
+        "issued_at": _SECONDS_TO_MILLISECONDS,
+        "expires_at": _SECONDS_TO_MILLISECONDS,
+        "steam_id": _TEXT_TO_STEAM_ID
+    },
+    "user_sessions": {
+        "session_start": _SECONDS_TO_MILLISECONDS,
+        "session_end": _SECONDS_TO_MILLISECONDS,
+        "last_activity": _SECONDS_TO_MILLISECONDS,
+        "steam_id": _TEXT_TO_STEAM_ID
+    },
+}
+
+_SQLITE_DIALECT = SQLiteDialect()
+
+def _normalized_sql(sql):
+    return " ".join(sql.split())
+
+def _ddl(element):
+    """A CREATE statement as SQLite records it in sqlite_master, up to whitespace."""
+    return _normalized_sql(str(element.compile(dialect=_SQLITE_DIALECT)))
+
+def _table_sql(sync_conn, name):
+    return sync_conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).scalar()
+
+def _column_types(sync_conn, name):
+    return {row[1]: row[2].upper() for row in sync_conn.exec_driver_sql(f"PRAGMA table_info({name})")}
+
+def _legacy_column_sql(table, column_types):
+    """SQL expressions converting the legacy-typed columns of a table while copying its rows."""
+    return {
+        name: conversion_sql.format(column=name)
+        for name, (legacy_types, conversion_sql) in LEGACY_COLUMN_CONVERSIONS.get(table.name, {}).items()
+        if column_types.get(name) in legacy_types
+    }
+
+def _copy_legacy_rows(sync_conn, table, legacy_name, column_sql, or_ignore=False):
+    legacy_columns = _column_types(sync_conn, legacy_name)
+    columns = [c.name for c in table.columns if c.name in legacy_columns]
+    sync_conn.exec_driver_sql(
+        f"INSERT {'OR IGNORE ' if or_ignore else ''}INTO {table.name} ({', '.join(columns)}) "
+        f"SELECT {', '.join(column_sql.get(c, c) for c in columns)} FROM {legacy_name}"
+    )
+    sync_conn.exec_driver_sql(f"DROP TABLE {legacy_name}")
+
+def _rebuild_table(sync_conn, table, column_sql=None):
+    """Recreate a table from its current model definition and copy the legacy rows across.
+
+    column_sql maps column names to SQL expressions used to convert legacy values while copying.
+    """
+    column_sql = column_sql or {}
+    legacy_name = f"{table.name}_legacy"
+    # Indexes follow a renamed table, so drop them first to free their names for the new table
+    legacy_indexes = sync_conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table.name,)
+    ).scalars().all()
+    for name in legacy_indexes:
+        sync_conn.exec_driver_sql(f"DROP INDEX {name}")
+    sync_conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {legacy_name}")
+    table.create(sync_conn)
+    _copy_legacy_rows(sync_conn, table, legacy_name, column_sql)
+
+def _migrate_legacy_schema(sync_conn):
+    for table in Base.metadata.sorted_tables:
+        # Before migrations ran in one transaction, a failed rebuild could leave the rows in
+        # <table>_legacy next to a new, empty table; finish that copy first
+        legacy_name = f"{table.name}_legacy"
+        if _table_sql(sync_conn, legacy_name):
+            table.create(sync_conn, checkfirst=True)
+            legacy_sql = _legacy_column_sql(table, _column_types(sync_conn, legacy_name))
+            _copy_legacy_rows(sync_conn, table, legacy_name, legacy_sql, or_ignore=True)
+        sql = _table_sql(sync_conn, table.name)
+        if not sql:
+            continue
+        # Column affinity would coerce converted values back, so converting in place is not enough
+        column_sql = _legacy_column_sql(table, _column_types(sync_conn, table.name))
+        # Any other difference from the model (WITHOUT ROWID, primary key, column types) also
+        # needs a rebuild, since SQLite's ALTER TABLE cannot change those
+        if column_sql or _normalized_sql(sql) != _ddl(CreateTable(table)):
+            _rebuild_table(sync_conn, table, column_sql)
+
+def _sync_indexes(sync_conn):
+    # create_all skips tables that already exist, so indexes added later are created here, and
+    # indexes whose definition changed (columns, partial predicate) are rebuilt under their name
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            sql = sync_conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (index.name,)
+            ).scalar()
+            if sql is not None and _normalized_sql(sql) == _ddl(CreateIndex(index)):
+                continue
+            if sql is not None:
+                index.drop(sync_conn)
+            index.create(sync_conn)
+    for name in LEGACY_INDEXES:
+        sync_conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+def _schema_fingerprint():
+    # The full DDL, so predicates, table options and constraints count as well as names
+    schema = sorted(
+        [_ddl(CreateTable(table)) for table in Base.metadata.tables.values()]
+        + [_ddl(CreateIndex(index)) for table in Base.metadata.tables.values() for index in table.indexes]
+    )
+    return hashlib.blake2b("\n".join(schema).encode()).hexdigest()
+
+# Recorded in schema_meta once the database matches the models, so unchanged boots skip the DDL checks
+SCHEMA_VERSION = _schema_fingerprint()
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all) 
\ No newline at end of file
+        await conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_meta (id INTEGER PRIMARY KEY CHECK (id = 1), v TEXT NOT NULL)"
+        )
+        stored_version = (await conn.exec_driver_sql("SELECT v FROM schema_meta")).scalar()
+        if stored_version == SCHEMA_VERSION:
+            return
+        await conn.run_sync(_migrate_legacy_schema)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_sync_indexes)
+        await conn.exec_driver_sql(
+            "INSERT INTO schema_meta (id, v) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET v = excluded.v",
+            (SCHEMA_VERSION,)
+        )
+        # Give the planner statistics for the (re)built tables and indexes
+        await conn.exec_driver_sql("ANALYZE")
+
+async def optimize_db():
+    """Let SQLite refresh planner statistics for tables that changed since the last run."""
+    # Committed, so the statistics it gathers are kept now that write transactions are explicit
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("PRAGMA optimize")
@@ -1,17 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Header, Request
+from fastapi import FastAPI, HTTPException, Query, status, Request, Response
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import time
 import uuid
-from server.db import SessionLocal, init_db, ForSaleItem, SaleHistory, PendingSale, ActiveUser, ActiveToken, UserSession
-import requests
+import random
+import hashlib
+import hmac
+import base64
+import orjson
+from cachetools import TTLCache
+from server.db import SessionLocal, ReadSession, init_db, optimize_db, bulk_insert_for_sale, stream_listings, read_scalar, now_ms, ms_to_seconds, touch_active_user, RENEW_TOKEN, RENEW_ACTIVE_USER, TOUCH_USER_SESSIONS, ForSaleItem, SaleHistory, PendingSale, ActiveUser, ActiveToken, UserSession
+import httpx
 import os
 import jwt
+from jwt.algorithms import HMACAlgorithm
 from sqlalchemy.future import select
-from sqlalchemy import delete, update
+from sqlalchemy import delete, update, tuple_, exists, func
 import asyncio
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from contextlib import asynccontextmanager
 import logging
 
@@ -45,40 +52,140 @@ class BuyRequest(BaseModel):
     client_silver: int
 
 class RemoveItemRequest(BaseModel):
-    index: int
+    id: int
 
 class TokenData(BaseModel):
     steam_id: str
     player_name: str
 
+ASYNCIO_DEBUG = os.environ.get("ASYNCIO_DEBUG", "false").lower() in ("1", "true", "yes")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if ASYNCIO_DEBUG:
+        # Log any callback that holds the event loop for more than 50ms
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = 0.05
     await init_db()
+    # Shared HTTP client so Steam API calls reuse pooled keep-alive connections
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
     # Start cleanup task
     cleanup_task = asyncio.create_task(cleanup_expired_tokens())
+    renewal_task = asyncio.create_task(renewal_flusher())
     logger.info("Server started with database persistence")
     yield
     cleanup_task.cancel()
+    renewal_task.cancel()
+    # Write out renewals queued since the last tick
+    await flush_renewals()
+    await app.state.http.aclose()
 
 app = FastAPI(
     title="RimWorld Galactic Trade (MTN) API",
     description="API for facilitating cross-colony trade in RimWorld.",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "supersecret")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# The algorithm and key never change, so the HMAC key and the encoded header are prepared
+# once. Tokens interoperate with PyJWT both ways, but are not always byte-identical to
+# jwt.encode: orjson writes non-ASCII player names as raw UTF-8 where json.dumps escapes them
+_JWT_HMAC = HMACAlgorithm(HMACAlgorithm.SHA256)
+_JWT_KEY = _JWT_HMAC.prepare_key(JWT_SECRET_KEY)
+
+def _b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _b64url_decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+_JWT_HEADER_B64 = _b64url_encode(orjson.dumps({"alg": JWT_ALGORITHM, "typ": "JWT"}))
+
+def encode_jwt(payload: Dict[str, Any]) -> str:
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url_encode(orjson.dumps(payload))
+    return (signing_input + b"." + _b64url_encode(_JWT_HMAC.sign(signing_input, _JWT_KEY))).decode()
+
+def decode_jwt(token: str) -> Dict[str, Any]:
+    """Verify an HS256 token and its exp claim; raises the same errors as jwt.decode"""
+    try:
+        signing_input, signature = token.encode().rsplit(b".", 1)
+        header_b64, payload_b64 = signing_input.split(b".")
+        if header_b64 != _JWT_HEADER_B64 and orjson.loads(_b64url_decode(header_b64)).get("alg") != JWT_ALGORITHM:
+            raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+        if not hmac.compare_digest(_JWT_HMAC.sign(signing_input, _JWT_KEY), _b64url_decode(signature)):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        payload = orjson.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError, AttributeError, orjson.JSONDecodeError) as e:
+        raise jwt.DecodeError("Invalid token") from e
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload")
+    exp = payload.get("exp")
+    if exp is not None:
+        if not isinstance(exp, (int, float)):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be a number")
+        if exp <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+    return payload
+
+# Recently verified tokens, keyed by token hash. An entry lives for 60s, so a busy token
+# hits the database (and renews its expiry) at most once a minute
+TOKEN_CACHE_TTL_SECONDS = 60
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Revocations bump "gen" after they commit, so a verification that read the token row before
+# the revocation never stores it
+_TOKEN_CACHE_STATE = {"gen": 0}
+
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _invalidate_token_cache(token: Optional[str] = None):
+    """Drop one token's cached verification, or all of them when no token is given"""
+    _TOKEN_CACHE_STATE["gen"] += 1
+    if token is None:
+        _TOKEN_CACHE.clear()
+    else:
+        _TOKEN_CACHE.pop(_token_cache_key(token), None)
+
+# Serialized /forsale body shared by every browsing player for a couple of seconds. Listing
+# writes bump "gen" so a response built from pre-write rows is never stored
+FORSALE_CACHE_TTL_SECONDS = 2.0
+_FORSALE_CACHE = {"body": b"", "exp": 0.0, "gen": 0}
+
+def _invalidate_forsale_cache():
+    _FORSALE_CACHE["exp"] = 0.0
+    _FORSALE_CACHE["gen"] += 1
+
+# Token renewals queued by verify_jwt_token as (token, steam_id, ts_ms) and
+# written in batches by renewal_flusher, keeping writes off the request path. The same
+# batch refreshes last_seen and the last_activity of the user's open sessions
+RENEWAL_FLUSH_SECONDS = 1.0
+renewal_queue: asyncio.Queue = asyncio.Queue()
+
 STEAM_API_KEY = os.environ.get("STEAM_API_KEY", "YOUR_STEAM_API_KEY")
 APP_ID = 294100
 
 
-def validate_steam_ticket_with_api(auth_ticket_base64: str):
+STEAM_RETRY_STATUSES = {401, 429}
+
+def _steam_backoff(attempt: int) -> float:
+    # Jittered exponential backoff: ~0.2s, ~0.4s, ... capped at 4s
+    return min(4.0, 0.2 * 2 ** attempt) + random.uniform(0, 0.1)
+
+async def validate_steam_ticket_with_api(auth_ticket_base64: str, client: httpx.AsyncClient):
     if not STEAM_API_KEY or STEAM_API_KEY == "YOUR_STEAM_API_KEY":
         logger.warning("Steam API key not configured, using mock validation for development")
-        return "mock_steam_id_12345"
+        return 76561197960265728
     
     url = "https://api.steampowered.com/ISteamUserAuth/AuthenticateUserTicket/v1/"
     params = {
@@ -91,18 +198,23 @@ def validate_steam_ticket_with_api(auth_ticket_base64: str):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = await client.get(url, params=params)
             
-            # If we get a 401 from Steam API, retry
-            if response.status_code == 401:
+            # Steam answers 401 spuriously now and then, so it is retried alongside 429 and 5xx
+            if response.status_code in STEAM_RETRY_STATUSES or response.status_code >= 500:
                 if attempt < max_retries - 1:
-                    logger.warning(f"Steam API returned 401, retrying... (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(1)  # Wait 1 second before retry
+                    logger.warning(f"Steam API returned {response.status_code}, retrying... (attempt {attempt + 1}/{max_retries})")
+                    await asyncio.sleep(_steam_backoff(attempt))
                     continue
                 else:
-                    logger.error("Steam API returned 401 after all retries")
+                    logger.error(f"Steam API returned {response.status_code} after all retries")
                     raise HTTPException(status_code=401, detail="Steam authentication failed")
             
+            # Any other client error will not change on retry
+            if response.status_code >= 400:
+                logger.error(f"Steam API rejected the ticket request with {response.status_code}")
+                raise HTTPException(status_code=401, detail="Steam authentication failed")
+            
             data = response.json()
             
             if "response" not in data:
@@ -114,16 +226,16 @@ def validate_steam_ticket_with_api(auth_ticket_base64: str):
                 raise HTTPException(status_code=401, detail="Steam authentication failed")
             
             if "params" in response_data and "steamid" in response_data["params"]:
-                steam_id = response_data["params"]["steamid"]
+                steam_id = int(response_data["params"]["steamid"])
                 logger.info(f"Steam ticket validated for Steam ID: {steam_id}")
                 return steam_id
             else:
                 raise HTTPException(status_code=401, detail="Steam authentication failed")
                 
-        except (requests.exceptions.RequestException, requests.exceptions.JSONDecodeError) as e:
+        except (httpx.HTTPError, ValueError) as e:
             if attempt < max_retries - 1:
                 logger.warning(f"Steam API request failed, retrying... (attempt {attempt + 1}/{max_retries}): {e}")
-                time.sleep(1)
+                await asyncio.sleep(_steam_backoff(attempt))
                 continue
             else:
                 logger.error(f"Steam API request failed after all retries: {e}")
@@ -135,43 +247,29 @@ def validate_steam_ticket_with_api(auth_ticket_base64: str):
     # This should never be reached, but just in case
     raise HTTPException(status_code=401, detail="Steam authentication failed")
 
-async def generate_jwt_token(steam_id: str, player_name: str, request: Request = None):
+async def generate_jwt_token(steam_id: int, player_name: str, request: Request = None):
     expiration = time.time() + (JWT_EXPIRATION_HOURS * 3600)
     payload = {
-        'steam_id': steam_id,
+        'steam_id': str(steam_id),
         'player_name': player_name,
         'exp': expiration,
         'iat': time.time(),
         'jti': str(uuid.uuid4())
     }
-    token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    token = encode_jwt(payload)
     
     async with SessionLocal() as session:
         db_token = ActiveToken(
             token=token,
             steam_id=steam_id,
             player_name=player_name,
-            issued_at=time.time(),
-            expires_at=expiration,
+            issued_at=now_ms(),
+            expires_at=int(expiration * 1000),
             revoked=0
         )
         session.add(db_token)
         
-        existing_user = await session.execute(
-            select(ActiveUser).where(ActiveUser.steam_id == steam_id)
-        )
-        existing_user = existing_user.scalar_one_or_none()
-        
-        if existing_user:
-            existing_user.last_seen = time.time()
-            existing_user.player_name = player_name
-        else:
-            db_user = ActiveUser(
-                steam_id=steam_id,
-                player_name=player_name,
-                last_seen=time.time()
-            )
-            session.add(db_user)
+        await touch_active_user(session, steam_id, player_name, now_ms())
         
         # Create new user session
         user_agent = request.headers.get("user-agent") if request else None
@@ -179,8 +277,8 @@ async def generate_jwt_token(steam_id: str, player_name: str, request: Request =
         db_session = UserSession(
             steam_id=steam_id,
             player_name=player_name,
-            session_start=time.time(),
-            last_activity=time.time(),
+            session_start=now_ms(),
+            last_activity=now_ms(),
             is_active=True,
             user_agent=user_agent
         )
@@ -191,72 +289,89 @@ async def generate_jwt_token(steam_id: str, player_name: str, request: Request =
     return token
 
 async def verify_jwt_token(token: str):
+    cache_key = _token_cache_key(token)
+    cached_payload = _TOKEN_CACHE.get(cache_key)
+    if cached_payload and cached_payload['exp'] > time.time():
+        return cached_payload, "Valid"
+    generation = _TOKEN_CACHE_STATE["gen"]
     try:
-        async with SessionLocal() as session:
-            # Check if token is revoked in database
-            db_token = await session.execute(
-                select(ActiveToken).where(ActiveToken.token == token)
-            )
-            db_token = db_token.scalar_one_or_none()
+        # Renewals are queued, so verification only reads
+        async with ReadSession() as session:
+            # Check if token is revoked in database (primary key lookup)
+            db_token = await session.get(ActiveToken, token)
             
-            if not db_token or db_token.revoked == 1:
+            if not db_token or db_token.revoked:
                 return None, "Token has been revoked"
             
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            steam_id = payload.get('steam_id')
+            payload = decode_jwt(token)
+            # Steam IDs travel as strings in the token but are stored as integers
+            steam_id = int(payload['steam_id'])
+            payload['steam_id'] = steam_id
             
             # Renew token expiration and update last_seen for active user
             if steam_id:
                 new_expiration = time.time() + (JWT_EXPIRATION_HOURS * 3600)
                 
-                # Update token expiration in database
-                await session.execute(
-                    update(ActiveToken)
-                    .where(ActiveToken.token == token)
-                    .values(expires_at=new_expiration)
-                )
-                
-                # Update last_seen for active user
-                await session.execute(
-                    update(ActiveUser)
-                    .where(ActiveUser.steam_id == steam_id)
-                    .values(last_seen=time.time())
-                )
-                
-                await session.commit()
+                # The database write happens in renewal_flusher
+                renewal_queue.put_nowait((token, steam_id, now_ms()))
                 
                 # Update payload with new expiration
                 payload['exp'] = new_expiration
             
+            if generation == _TOKEN_CACHE_STATE["gen"]:
+                _TOKEN_CACHE[cache_key] = payload
             return payload, "Valid"
     except jwt.ExpiredSignatureError:
         return None, "Token has expired"
-    except jwt.InvalidTokenError:
+    except (jwt.InvalidTokenError, KeyError, ValueError):
         return None, "Invalid token"
 
-async def get_current_user(authorization: str = Header(None)) -> Dict[str, Any]:
-    if not authorization:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header",
-        )
-    if not authorization.startswith('Bearer '):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid authorization format",
-        )
-    token = authorization[7:]
-    payload, message = await verify_jwt_token(token)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-        )
-    return payload
+class AuthMiddleware:
+    """Pure ASGI middleware that verifies the bearer token once per request.
+
+    The outcome is left in the scope for current_user(): the payload under "user", or the
+    (status, detail) to raise under "auth_error". Routes that need no login ignore both.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope["user"] = None
+            scope["auth_token"] = None
+            scope["auth_error"] = None
+            authorization = None
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value.decode("latin-1")
+                    break
+            if not authorization:
+                scope["auth_error"] = (status.HTTP_401_UNAUTHORIZED, "Missing authorization header")
+            elif not authorization.startswith('Bearer '):
+                scope["auth_error"] = (status.HTTP_400_BAD_REQUEST, "Invalid authorization format")
+            else:
+                token = authorization[7:]
+                payload, message = await verify_jwt_token(token)
+                if payload:
+                    scope["user"] = payload
+                    scope["auth_token"] = token
+                else:
+                    scope["auth_error"] = (status.HTTP_401_UNAUTHORIZED, "Invalid token")
+        await self.app(scope, receive, send)
+
+app.add_middleware(AuthMiddleware)
+
+def current_user(request: Request) -> Dict[str, Any]:
+    """Return the authenticated user's token payload, or raise the auth failure for this request"""
+    user = request.scope.get("user")
+    if not user:
+        status_code, detail = request.scope.get("auth_error") or (status.HTTP_401_UNAUTHORIZED, "Invalid token")
+        raise HTTPException(status_code=status_code, detail=detail)
+    return user
 
 @app.post('/auth/login', tags=["Authentication"])
 async def login(data: LoginRequest, request: Request):
-    steam_id = validate_steam_ticket_with_api(data.authTicket)
+    steam_id = await validate_steam_ticket_with_api(data.authTicket, request.app.state.http)
     token = await generate_jwt_token(steam_id, data.playerName, request)
     return {
         "status": "success",
@@ -267,8 +382,9 @@ async def login(data: LoginRequest, request: Request):
     }
 
 @app.post('/auth/logout', tags=["Authentication"])
-async def logout(authorization: str = Header(None), user: dict = Depends(get_current_user)):
-    token = authorization[7:]
+async def logout(request: Request):
+    user = current_user(request)
+    token = request.scope["auth_token"]
     steam_id = user.get('steam_id')
     
     async with SessionLocal() as session:
@@ -283,46 +399,62 @@ async def logout(authorization: str = Header(None), user: dict = Depends(get_cur
         await session.execute(
             update(UserSession)
             .where(UserSession.steam_id == steam_id, UserSession.is_active == True)
-            .values(session_end=time.time(), is_active=False)
+            .values(session_end=now_ms(), is_active=False)
         )
         
         # Check if user has any other active tokens
-        active_tokens_count = await session.execute(
-            select(ActiveToken)
-            .where(ActiveToken.steam_id == steam_id, ActiveToken.revoked == 0)
+        has_active_tokens = await session.scalar(
+            select(
+                exists().where(ActiveToken.steam_id == steam_id, ActiveToken.revoked == 0)
+            )
         )
-        active_tokens_count = active_tokens_count.scalars().all()
         
         # If no active tokens, remove user from active_users
-        if len(active_tokens_count) == 0:
+        if not has_active_tokens:
             await session.execute(
                 delete(ActiveUser).where(ActiveUser.steam_id == steam_id)
             )
         
         await session.commit()
+    # Only after the commit: a verification reading before it still sees the token live
+    _invalidate_token_cache(token)
     
     logger.info(f"User logged out: {user.get('player_name')} (Steam ID: {steam_id})")
     return {"status": "success", "message": "Logged out successfully"}
 
 @app.get('/auth/validate', tags=["Authentication"])
-async def validate_token(user: dict = Depends(get_current_user)):
+async def validate_token(request: Request):
+    user = current_user(request)
     return {
         "status": "success",
-        "steam_id": user.get('steam_id'),
+        "steam_id": str(user.get('steam_id')),
         "player_name": user.get('player_name'),
         "valid": True
     }
 
 @app.post('/buy', tags=["Trading"])
-async def handle_buy(data: BuyRequest, user: dict = Depends(get_current_user), request: Request = None):
+async def handle_buy(data: BuyRequest, request: Request):
+    user = current_user(request)
     steam_id = user.get('steam_id')
     
+    now = now_ms()
+    keys = {(i.def_name, i.seller_name) for i in data.items}
+    
     async with SessionLocal() as session:
-        # Get all items for sale from database
-        result = await session.execute(select(ForSaleItem))
-        for_sale_items = result.scalars().all()
+        # Load only the listings in the cart. The write engine opens this transaction with
+        # BEGIN IMMEDIATE, so concurrent buys queue on the write lock instead of both reading
+        # the same quantities
+        result = await session.execute(
+            select(ForSaleItem)
+            .where(tuple_(ForSaleItem.def_name, ForSaleItem.player_name).in_(keys))
+            .order_by(ForSaleItem.id)
+        )
+        by_key = {}
+        for item in result.scalars():
+            # Use the first matching item (should be unique based on seller + item)
+            by_key.setdefault((item.def_name, item.player_name), item)
         
-        # Validate all purchases first
+        # Validate and apply in one pass; raising before the commit discards every change
         purchased_items, total_cost = [], 0
         
         for item_request in data.items:
@@ -330,46 +462,16 @@ async def handle_buy(data: BuyRequest, user: dict = Depends(get_current_user), r
             quantity = item_request.quantity
             seller_name = item_request.seller_name
             
-            # Find the specific item by def_name and seller_name
-            matching_items = [item for item in for_sale_items 
-                            if item.def_name == def_name and item.player_name == seller_name]
-            
-            if not matching_items:
+            item = by_key.get((def_name, seller_name))
+            if item is None:
                 raise HTTPException(status_code=400, detail=f"Item {def_name} from {seller_name} is no longer available")
             
-            # Use the first matching item (should be unique based on seller + item)
-            item = matching_items[0]
             available_quantity = item.quantity
-            
             if quantity > available_quantity:
                 raise HTTPException(status_code=400, detail=f"Not enough {item.def_name} available. Requested: {quantity}, Available: {available_quantity}")
             
             item_cost = item.price * quantity
             total_cost += item_cost
-        
-        # Check if user has enough silver
-        if hasattr(data, 'client_silver') and data.client_silver < total_cost:
-            raise HTTPException(status_code=400, detail=f"Not enough silver. Required: {total_cost}, You have: {data.client_silver}")
-        
-        # Process purchases
-        purchased_items, total_cost = [], 0
-        
-        for item_request in data.items:
-            def_name = item_request.def_name
-            quantity = item_request.quantity
-            seller_name = item_request.seller_name
-            
-            # Find the specific item again (in case quantities changed)
-            matching_items = [item for item in for_sale_items 
-                            if item.def_name == def_name and item.player_name == seller_name]
-            
-            if not matching_items:
-                continue  # Skip if item was already purchased by another user
-            
-            item = matching_items[0]
-            available_quantity = item.quantity
-            item_cost = item.price * quantity
-            total_cost += item_cost
             
             # Create purchased item details
             purchased_item_details = {
@@ -378,13 +480,14 @@ async def handle_buy(data: BuyRequest, user: dict = Depends(get_current_user), r
                 'Price': item.price,
                 'PlayerName': item.player_name,
                 'Quality': item.quality,
-                'seller_steam_id': item.seller_steam_id,
+                'seller_steam_id': str(item.seller_steam_id),
                 'seller_name': item.player_name
             }
             
             if quantity == available_quantity:
                 # Remove item completely from database
                 await session.delete(item)
+                del by_key[(def_name, seller_name)]
             else:
                 # Update quantity in database
                 item.quantity -= quantity
@@ -400,24 +503,26 @@ async def handle_buy(data: BuyRequest, user: dict = Depends(get_current_user), r
                     quantity=quantity,
                     price=item.price,
                     total_silver=item_cost,
-                    timestamp=time.time()
+                    timestamp=now
                 )
                 session.add(pending_sale)
         
+        # Check if user has enough silver
+        if hasattr(data, 'client_silver') and data.client_silver < total_cost:
+            raise HTTPException(status_code=400, detail=f"Not enough silver. Required: {total_cost}, You have: {data.client_silver}")
+        
         # Create sale history record
-        from sqlalchemy import text
-        import json
-        await session.execute(text("PRAGMA foreign_keys=ON"))
         sale_record = SaleHistory(
-            timestamp=time.time(),
+            timestamp=now,
             buyer_steam_id=steam_id,
             buyer_name=user.get('player_name'),
-            purchased_items=json.dumps(purchased_items),
+            purchased_items=purchased_items,
             total_cost=total_cost
         )
         session.add(sale_record)
         
         await session.commit()
+    _invalidate_forsale_cache()
     
     return {
         "status": "success",
@@ -426,42 +531,39 @@ async def handle_buy(data: BuyRequest, user: dict = Depends(get_current_user), r
     }
 
 @app.post('/trade', tags=["Trading"])
-async def handle_trade(data: SellRequest, user: dict = Depends(get_current_user), request: Request = None):
-    newly_listed_items = []
+async def handle_trade(data: SellRequest, request: Request):
+    user = current_user(request)
+    # One timestamp for the whole batch: the listings and their history record share it
+    now = now_ms()
+    rows = [{
+        'def_name': record.DefName,
+        'quantity': record.Quantity,
+        'price': record.Price,
+        'player_name': user.get('player_name'),
+        'seller_steam_id': user.get('steam_id'),
+        'quality': record.Quality,
+        'listed_at': now
+    } for record in data.records]
+    newly_listed_items = [{
+        'DefName': row['def_name'],
+        'Quantity': row['quantity'],
+        'Price': row['price'],
+        'PlayerName': row['player_name'],
+        'Quality': row['quality']
+    } for row in rows]
     async with SessionLocal() as session:
-        for record in data.records:
-            item = record.model_dump()
-            db_item = ForSaleItem(
-                def_name=item['DefName'],
-                quantity=item['Quantity'],
-                price=item['Price'],
-                player_name=user.get('player_name'),
+        # One transaction for all listings and the history record, so a single commit
+        async with session.begin():
+            await bulk_insert_for_sale(session, rows)
+            sale_record = SaleHistory(
+                timestamp=now,
                 seller_steam_id=user.get('steam_id'),
-                quality=item.get('Quality', ""),
-                listed_at=time.time()
+                seller_name=user.get('player_name'),
+                purchased_items=newly_listed_items,
+                total_cost=0
             )
-            session.add(db_item)
-            await session.commit()
-            await session.refresh(db_item)
-            newly_listed_items.append({
-                'DefName': db_item.def_name,
-                'Quantity': db_item.quantity,
-                'Price': db_item.price,
-                'PlayerName': db_item.player_name,
-                'Quality': db_item.quality
-            })
-        from sqlalchemy import text
-        import json
-        await session.execute(text("PRAGMA foreign_keys=ON"))
-        sale_record = SaleHistory(
-            timestamp=time.time(),
-            seller_steam_id=user.get('steam_id'),
-            seller_name=user.get('player_name'),
-            purchased_items=json.dumps(newly_listed_items),
-            total_cost=0
-        )
-        session.add(sale_record)
-        await session.commit()
+            session.add(sale_record)
+    _invalidate_forsale_cache()
     return {
         "status": "success",
         "received": len(data.records),
@@ -470,48 +572,48 @@ async def handle_trade(data: SellRequest, user: dict = Depends(get_current_user)
 
 @app.get('/forsale', tags=["Marketplace"])
 async def get_for_sale(request: Request = None):
-    async with SessionLocal() as session:
-        result = await session.execute(select(ForSaleItem))
-        items = result.scalars().all()
-        filtered_items = []
-        for item in items:
-            filtered = {
-                'DefName': str(item.def_name or ''),
-                'Quantity': int(item.quantity or 0),
-                'Price': int(item.price or 0),
-                'PlayerName': str(item.player_name or ''),
-                'Quality': str(item.quality or '')
-            }
-            filtered_items.append(filtered)
-    return {"records": filtered_items}
+    if _FORSALE_CACHE["exp"] > time.time():
+        return Response(_FORSALE_CACHE["body"], media_type="application/json")
+    generation = _FORSALE_CACHE["gen"]
+    async with ReadSession() as session:
+        filtered_items = [{
+            'DefName': str(item['def_name'] or ''),
+            'Quantity': int(item['quantity'] or 0),
+            'Price': int(item['price'] or 0),
+            'PlayerName': str(item['player_name'] or ''),
+            'Quality': str(item['quality'] or '')
+        } async for item in stream_listings(session)]
+    body = orjson.dumps({"records": filtered_items})
+    if generation == _FORSALE_CACHE["gen"]:
+        _FORSALE_CACHE.update(body=body, exp=time.time() + FORSALE_CACHE_TTL_SECONDS)
+    return Response(body, media_type="application/json")
 
 @app.get('/my-items', tags=["User"])
-async def get_my_items(user: dict = Depends(get_current_user)):
+async def get_my_items(request: Request):
+    user = current_user(request)
     user_steam_id = user.get('steam_id')
-    async with SessionLocal() as session:
-        result = await session.execute(select(ForSaleItem).where(ForSaleItem.seller_steam_id == user_steam_id))
-        my_items = result.scalars().all()
+    async with ReadSession() as session:
         items = [{
-            'DefName': item.def_name,
-            'Quantity': item.quantity,
-            'Price': item.price,
-            'PlayerName': item.player_name,
-            'Quality': item.quality
-        } for item in my_items]
+            'id': item['id'],
+            'DefName': item['def_name'],
+            'Quantity': item['quantity'],
+            'Price': item['price'],
+            'PlayerName': item['player_name'],
+            'Quality': item['quality']
+        } async for item in stream_listings(session, seller_steam_id=user_steam_id)]
     return {"my_items": items, "count": len(items)}
 
 @app.post('/remove-item', tags=["User"])
-async def remove_item(data: RemoveItemRequest, user: dict = Depends(get_current_user)):
-    item_index = data.index
+async def remove_item(data: RemoveItemRequest, request: Request):
+    user = current_user(request)
     user_steam_id = user.get('steam_id')
     async with SessionLocal() as session:
-        result = await session.execute(select(ForSaleItem).where(ForSaleItem.seller_steam_id == user_steam_id))
-        my_items = result.scalars().all()
-        if item_index >= len(my_items):
-            raise HTTPException(status_code=400, detail="Invalid item index")
-        item = my_items[item_index]
+        item = await session.get(ForSaleItem, data.id)
+        if item is None or item.seller_steam_id != user_steam_id:
+            raise HTTPException(status_code=404, detail="Item not found")
         await session.delete(item)
         await session.commit()
+        _invalidate_forsale_cache()
         logger.info(f"{user.get('player_name')} removed item: {item.def_name}")
         removed_item = {
             'DefName': item.def_name,
@@ -523,28 +625,45 @@ async def remove_item(data: RemoveItemRequest, user: dict = Depends(get_current_
     return {"status": "success", "removed_item": removed_item}
 
 @app.get('/sales/pending', tags=["User"])
-async def get_pending_sales(user: dict = Depends(get_current_user)):
+async def get_pending_sales(request: Request):
+    user = current_user(request)
     user_steam_id = user.get('steam_id')
-    async with SessionLocal() as session:
-        result = await session.execute(select(PendingSale).where(PendingSale.seller_steam_id == user_steam_id))
-        user_pending_sales = result.scalars().all()
+    async with ReadSession() as session:
+        result = await session.execute(
+            select(
+                PendingSale.buyer_name,
+                PendingSale.item,
+                PendingSale.quantity,
+                PendingSale.price,
+                PendingSale.total_silver,
+                PendingSale.timestamp
+            ).where(PendingSale.seller_steam_id == user_steam_id)
+        )
+        user_pending_sales = result.all()
         sales_list = [{
             'buyer_name': sale.buyer_name,
             'item': sale.item,
             'quantity': sale.quantity,
             'price': sale.price,
             'total_silver': sale.total_silver,
-            'timestamp': sale.timestamp
+            'timestamp': ms_to_seconds(sale.timestamp)
         } for sale in user_pending_sales]
     return {"pending_sales": sales_list, "count": len(sales_list)}
 
 @app.post('/sales/claim', tags=["User"])
-async def claim_sales(user: dict = Depends(get_current_user), data: Optional[Dict[str, Any]] = None):
+async def claim_sales(request: Request, data: Optional[Dict[str, Any]] = None):
+    user = current_user(request)
     steam_id = user.get('steam_id')
     async with SessionLocal() as session:
-        result = await session.execute(select(PendingSale).where(PendingSale.seller_steam_id == steam_id))
-        user_pending_sales = result.scalars().all()
-        if not user_pending_sales:
+        # Delete and total in one statement, so a sale recorded mid-claim is neither lost nor paid twice
+        result = await session.execute(
+            delete(PendingSale)
+            .where(PendingSale.seller_steam_id == steam_id)
+            .returning(PendingSale.price * PendingSale.quantity)
+        )
+        claimed_amounts = result.scalars().all()
+        await session.commit()
+        if not claimed_amounts:
             # Return success response with 0 silver claimed instead of error
             return {
                 "status": "success",
@@ -552,114 +671,106 @@ async def claim_sales(user: dict = Depends(get_current_user), data: Optional[Dic
                 "claimed_sales_count": 0,
                 "message": "No pending sales to claim"
             }
-        total_silver_claimed = sum(sale.price * sale.quantity for sale in user_pending_sales)
-        for sale in user_pending_sales:
-            await session.delete(sale)
-        await session.commit()
+        total_silver_claimed = sum(claimed_amounts)
     logger.info(f"{user.get('player_name')} claimed {total_silver_claimed} silver")
     return {
         "status": "success",
         "total_claimed": int(total_silver_claimed),
-        "claimed_sales_count": len(user_pending_sales)
+        "claimed_sales_count": len(claimed_amounts)
     }
 
 @app.get('/user/info', tags=["User"])
-async def get_user_info_endpoint(user: dict = Depends(get_current_user)):
+async def get_user_info_endpoint(request: Request):
+    user = current_user(request)
     steam_id = user.get('steam_id')
-    async with SessionLocal() as session:
-        from sqlalchemy import text
-        import json
-        await session.execute(text("PRAGMA foreign_keys=ON"))
-        result_items = await session.execute(select(ForSaleItem).where(ForSaleItem.seller_steam_id == steam_id))
-        user_items = result_items.scalars().all()
-        result_purchases = await session.execute(select(SaleHistory).where(SaleHistory.buyer_steam_id == steam_id))
-        user_purchases = result_purchases.scalars().all()
-        result_sales = await session.execute(select(SaleHistory).where(SaleHistory.seller_steam_id == steam_id))
-        user_sales = result_sales.scalars().all()
-        
-        # Get user's last_seen from database
-        user_info = await session.execute(
-            select(ActiveUser).where(ActiveUser.steam_id == steam_id)
-        )
-        user_info = user_info.scalar_one_or_none()
-        last_seen = user_info.last_seen if user_info else None
-        
+    # Independent single-row queries, each on its own read connection so they run concurrently
+    items_count, purchases_count, sales_count, last_seen = await asyncio.gather(
+        read_scalar(select(func.count()).where(ForSaleItem.seller_steam_id == steam_id)),
+        read_scalar(select(func.count()).where(SaleHistory.buyer_steam_id == steam_id)),
+        read_scalar(select(func.count()).where(SaleHistory.seller_steam_id == steam_id)),
+        read_scalar(select(ActiveUser.last_seen).where(ActiveUser.steam_id == steam_id))
+    )
+    last_seen = ms_to_seconds(last_seen) if last_seen is not None else None
+    
     return {
-        "steam_id": steam_id,
+        "steam_id": str(steam_id),
         "player_name": user.get('player_name'),
-        "items_for_sale": len(user_items),
-        "total_purchases": len(user_purchases),
-        "total_sales": len(user_sales),
+        "items_for_sale": items_count,
+        "total_purchases": purchases_count,
+        "total_sales": sales_count,
         "last_seen": last_seen
     }
 
 @app.get('/marketplace/stats', tags=["Marketplace"])
 async def get_marketplace_stats():
-    async with SessionLocal() as session:
-        result_items = await session.execute(select(ForSaleItem))
-        items = result_items.scalars().all()
-        result_sales = await session.execute(select(SaleHistory))
-        sales = result_sales.scalars().all()
-        unique_sellers = {item.seller_steam_id for item in items if item.seller_steam_id}
-        
-        # Get active users count from sessions (last 30 minutes)
-        current_time = time.time()
-        active_threshold = current_time - (30 * 60)  # 30 minutes
-        active_sessions = await session.execute(
-            select(UserSession)
-            .where(UserSession.last_activity > active_threshold, UserSession.is_active == True)
-        )
-        active_sessions = active_sessions.scalars().all()
-        active_users_count = len(set(session.steam_id for session in active_sessions))
+    # Active users are those with session activity in the last 30 minutes
+    active_threshold = now_ms() - (30 * 60 * 1000)
+    # Every figure is a scalar subquery, so the whole summary is one statement
+    stats_query = select(
+        select(func.count()).select_from(ForSaleItem).scalar_subquery().label("items"),
+        select(func.count()).select_from(SaleHistory).scalar_subquery().label("sales"),
+        select(func.count(func.distinct(ForSaleItem.seller_steam_id))).scalar_subquery().label("sellers"),
+        select(func.count(func.distinct(UserSession.steam_id)))
+        .where(UserSession.last_activity > active_threshold, UserSession.is_active == True)
+        .scalar_subquery().label("active")
+    )
+    async with ReadSession() as session:
+        stats = (await session.execute(stats_query)).one()
         
     return {
-        "total_items_for_sale": len(items),
-        "active_users": active_users_count,
-        "total_transactions": len(sales),
-        "unique_sellers": len(unique_sellers),
+        "total_items_for_sale": stats.items,
+        "active_users": stats.active,
+        "total_transactions": stats.sales,
+        "unique_sellers": stats.sellers,
         "server_uptime": time.time(), # This should be improved to be a real uptime
         "active_users_definition": "Users with activity in the last 30 minutes"
     }
 
 @app.get('/admin/users', tags=["Admin"])
-async def get_active_users(user: dict = Depends(get_current_user)):
-    async with SessionLocal() as session:
+async def get_active_users(request: Request):
+    current_user(request)
+    async with ReadSession() as session:
         # Get users with active sessions (logged in within last 30 minutes)
-        current_time = time.time()
-        active_threshold = current_time - (30 * 60)  # 30 minutes
+        current_time = now_ms()
+        active_threshold = current_time - (30 * 60 * 1000)  # 30 minutes
         
-        # Get users with recent activity
+        # Get users with recent activity, one row each. With a single MAX() SQLite takes the
+        # bare columns from the row holding the maximum, i.e. the most recent session
         active_sessions = await session.execute(
-            select(UserSession)
+            select(
+                UserSession.steam_id,
+                UserSession.player_name,
+                UserSession.session_start,
+                func.max(UserSession.last_activity).label("last_activity")
+            )
             .where(UserSession.last_activity > active_threshold, UserSession.is_active == True)
+            .group_by(UserSession.steam_id)
         )
-        active_sessions = active_sessions.scalars().all()
+        active_sessions = active_sessions.all()
         
-        # Get unique active users
-        active_users_data = []
-        seen_steam_ids = set()
+        # Active token counts for all of these users in one query
+        token_counts = await session.execute(
+            select(ActiveToken.steam_id, func.count())
+            .where(
+                ActiveToken.steam_id.in_({s.steam_id for s in active_sessions}),
+                ActiveToken.revoked == 0
+            )
+            .group_by(ActiveToken.steam_id)
+        )
+        token_counts = dict(token_counts.all())
         
-        for session in active_sessions:
-            if session.steam_id not in seen_steam_ids:
-                seen_steam_ids.add(session.steam_id)
-                
-                # Get active token count for this user
-                token_count = await session.execute(
-                    select(ActiveToken)
-                    .where(ActiveToken.steam_id == session.steam_id, ActiveToken.revoked == 0)
-                )
-                token_count = len(token_count.scalars().all())
-                
-                # Calculate session duration
-                session_duration = current_time - session.session_start
-                
-                active_users_data.append({
-                    "steam_id": session.steam_id,
-                    "player_name": session.player_name,
-                    "last_activity": session.last_activity,
-                    "session_duration_minutes": int(session_duration / 60),
-                    "active_tokens": token_count
-                })
+        active_users_data = []
+        for user_session in active_sessions:
+            # Calculate session duration
+            session_duration = current_time - user_session.session_start
+            
+            active_users_data.append({
+                "steam_id": str(user_session.steam_id),
+                "player_name": user_session.player_name,
+                "last_activity": ms_to_seconds(user_session.last_activity),
+                "session_duration_minutes": int(session_duration / 60000),
+                "active_tokens": token_counts.get(user_session.steam_id, 0)
+            })
         
         return {
             "status": "success",
@@ -669,29 +780,40 @@ async def get_active_users(user: dict = Depends(get_current_user)):
         }
 
 @app.get('/admin/sessions', tags=["Admin"])
-async def get_user_sessions(user: dict = Depends(get_current_user), limit: int = 50):
-    """Get recent user sessions for monitoring"""
-    async with SessionLocal() as session:
-        result = await session.execute(
-            select(UserSession)
-            .order_by(UserSession.session_start.desc())
-            .limit(limit)
-        )
+async def get_user_sessions(request: Request, limit: int = Query(50, ge=1, le=500), before: Optional[str] = None):
+    """Get recent user sessions for monitoring, newest first.
+
+    Pass the previous page's next_cursor as `before` to continue from where it ended.
+    """
+    current_user(request)
+    stmt = (
+        select(UserSession)
+        .order_by(UserSession.session_start.desc(), UserSession.id.desc())
+        .limit(limit)
+    )
+    if before:
+        try:
+            cursor_start, cursor_id = (int(part) for part in before.split(":"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(tuple_(UserSession.session_start, UserSession.id) < (cursor_start, cursor_id))
+    async with ReadSession() as session:
+        result = await session.execute(stmt)
         sessions = result.scalars().all()
         
         sessions_data = []
         for session in sessions:
             session_duration = None
             if session.session_end:
-                session_duration = int((session.session_end - session.session_start) / 60)
+                session_duration = int((session.session_end - session.session_start) / 60000)
             else:
-                session_duration = int((time.time() - session.session_start) / 60)
+                session_duration = int((now_ms() - session.session_start) / 60000)
             
             sessions_data.append({
-                "steam_id": session.steam_id,
+                "steam_id": str(session.steam_id),
                 "player_name": session.player_name,
-                "session_start": session.session_start,
-                "session_end": session.session_end,
+                "session_start": ms_to_seconds(session.session_start),
+                "session_end": ms_to_seconds(session.session_end),
                 "session_duration_minutes": session_duration,
                 "is_active": session.is_active,
                 "user_agent": session.user_agent
@@ -700,30 +822,33 @@ async def get_user_sessions(user: dict = Depends(get_current_user), limit: int =
         return {
             "status": "success",
             "sessions": sessions_data,
-            "total_sessions": len(sessions_data)
+            "total_sessions": len(sessions_data),
+            # Keyset cursor: the last row's (session_start ms, id), or None after the final page
+            "next_cursor": f"{sessions[-1].session_start}:{sessions[-1].id}" if sessions and len(sessions) == limit else None
         }
 
 @app.get('/debug/pending_sales')
 async def debug_pending_sales():
-    async with SessionLocal() as session:
+    async with ReadSession() as session:
         result = await session.execute(select(PendingSale))
         all_pending = result.scalars().all()
         debug_list = [{
-            'seller_steam_id': sale.seller_steam_id,
+            'seller_steam_id': str(sale.seller_steam_id),
             'buyer_name': sale.buyer_name,
             'item': sale.item,
             'quantity': sale.quantity,
             'price': sale.price,
             'total_silver': sale.total_silver,
-            'timestamp': sale.timestamp
+            'timestamp': ms_to_seconds(sale.timestamp)
         } for sale in all_pending]
     return debug_list
 
 @app.get('/admin/cleanup', tags=["Admin"])
-async def manual_cleanup(user: dict = Depends(get_current_user)):
+async def manual_cleanup(request: Request):
     """Manual cleanup of expired tokens and inactive users"""
+    current_user(request)
     try:
-        current_time = time.time()
+        current_time = now_ms()
         async with SessionLocal() as session:
             # Remove expired tokens
             expired_tokens = await session.execute(
@@ -731,7 +856,7 @@ async def manual_cleanup(user: dict = Depends(get_current_user)):
             )
             
             # Close inactive sessions
-            inactive_session_threshold = current_time - (2 * 3600)  # 2 hours
+            inactive_session_threshold = current_time - (2 * 3600 * 1000)  # 2 hours
             await session.execute(
                 update(UserSession)
                 .where(UserSession.last_activity < inactive_session_threshold, UserSession.is_active == True)
@@ -739,7 +864,7 @@ async def manual_cleanup(user: dict = Depends(get_current_user)):
             )
             
             # Remove users who haven't been seen in 24 hours
-            inactive_threshold = current_time - (24 * 3600)
+            inactive_threshold = current_time - (24 * 3600 * 1000)
             inactive_users = await session.execute(
                 select(ActiveUser).where(ActiveUser.last_seen < inactive_threshold)
             )
@@ -754,6 +879,9 @@ async def manual_cleanup(user: dict = Depends(get_current_user)):
                 await session.delete(user_obj)
             
             await session.commit()
+            if inactive_users:
+                # Their tokens are gone; drop cached verifications rather than wait out the TTL
+                _invalidate_token_cache()
             
             return {
                 "status": "success",
@@ -765,11 +893,46 @@ async def manual_cleanup(user: dict = Depends(get_current_user)):
         logger.error(f"Manual cleanup error: {e}")
         raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
 
+async def flush_renewals():
+    """Write all queued token renewals, keeping only the latest per token and per user"""
+    token_renewals = {}
+    user_renewals = {}
+    while not renewal_queue.empty():
+        token, steam_id, ts = renewal_queue.get_nowait()
+        token_renewals[token] = ts + JWT_EXPIRATION_HOURS * 3600 * 1000
+        user_renewals[steam_id] = ts
+    if not token_renewals:
+        return
+    
+    async with SessionLocal() as session:
+        await session.execute(
+            RENEW_TOKEN,
+            [{"tok": token, "exp": expires_at} for token, expires_at in token_renewals.items()]
+        )
+        await session.execute(
+            RENEW_ACTIVE_USER,
+            [{"sid": sid, "ts": ts} for sid, ts in user_renewals.items()]
+        )
+        await session.execute(
+            TOUCH_USER_SESSIONS,
+            [{"sid": sid, "ts": ts} for sid, ts in user_renewals.items()]
+        )
+        await session.commit()
+
+async def renewal_flusher():
+    """Background task that batches token renewals into one transaction per tick"""
+    while True:
+        await asyncio.sleep(RENEWAL_FLUSH_SECONDS)
+        try:
+            await flush_renewals()
+        except Exception as e:
+            logger.error(f"Renewal flush error: {e}")
+
 async def cleanup_expired_tokens():
     """Background task to clean up expired tokens and inactive users"""
     while True:
         try:
-            current_time = time.time()
+            current_time = now_ms()
             async with SessionLocal() as session:
                 # Remove expired tokens
                 await session.execute(
@@ -777,7 +940,7 @@ async def cleanup_expired_tokens():
                 )
                 
                 # Close sessions that have been inactive for more than 2 hours
-                inactive_session_threshold = current_time - (2 * 3600)  # 2 hours
+                inactive_session_threshold = current_time - (2 * 3600 * 1000)  # 2 hours
                 await session.execute(
                     update(UserSession)
                     .where(UserSession.last_activity < inactive_session_threshold, UserSession.is_active == True)
@@ -785,7 +948,7 @@ async def cleanup_expired_tokens():
                 )
                 
                 # Remove users who haven't been seen in 24 hours
-                inactive_threshold = current_time - (24 * 3600)
+                inactive_threshold = current_time - (24 * 3600 * 1000)
                 inactive_users = await session.execute(
                     select(ActiveUser).where(ActiveUser.last_seen < inactive_threshold)
                 )
@@ -802,7 +965,11 @@ async def cleanup_expired_tokens():
                 await session.commit()
                 
                 if inactive_users:
+                    _invalidate_token_cache()
                     logger.info(f"Removed {len(inactive_users)} inactive users and their tokens")
+            
+            # Long-lived connections never close, so refresh planner statistics here
+            await optimize_db()
                     
         except Exception as e:
             logger.error(f"Cleanup task error: {e}")
@@ -814,6 +981,8 @@ async def cleanup_expired_tokens():
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     logger.error(f"Validation error: {exc}")
     logger.error(f"Request body: {await request.body()}")
+    # stdlib JSON on purpose: errors() echoes the rejected input, which may hold integers
+    # wider than the 64 bits orjson can encode
     return JSONResponse(
         status_code=422,
         content={
@@ -827,4 +996,6 @@ if __name__ == "__main__" or __package__:
     import asyncio
     asyncio.run(init_db())
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # One process owns the SQLite engine and its pools; concurrency comes from asyncio
+    # ("auto" picks uvloop when it is installed, as with uvicorn[standard])
+    uvicorn.run(app, host='0.0.0.0', port=5000, workers=1, loop='auto') 
\ No newline at end of file